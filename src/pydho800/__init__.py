@@ -1 +1 @@
-from .pydho800 import PYDHO800
+from .pydho800 import PYDHO800, BufferRelaxMode
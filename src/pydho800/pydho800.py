@@ -7,13 +7,362 @@ from labdevices.scpi import SCPIDeviceEthernet
 import atexit
 import re
 
-from time import sleep
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from time import sleep, perf_counter
 
 import socket
 
 import logging
 import datetime
 from enum import Enum, IntEnum
+from types import MappingProxyType
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Maximum number of sample points the scope transfers with a single :WAV:DATA?
+# query in the given waveform format
+
+_WAV_CHUNK_POINTS = {
+    "BYTE" : 250_000,
+    "WORD" : 125_000
+}
+
+# Format identifiers reported in the waveform preamble
+
+_WAV_FORMAT_CODES = {
+    "BYTE"  : 0,
+    "WORD"  : 1,
+    "ASCII" : 2
+}
+
+# Sample representation of the binary formats. WORD carries the full 12 bit
+# resolution of the DHO800/900 as little endian 16 bit values
+
+_WAV_DTYPES = {
+    "BYTE" : np.dtype(np.uint8),
+    "WORD" : np.dtype("<u2")
+}
+
+# Two ASCII samples received without separator, i.e. the two digit exponent of
+# the first sample is directly followed by the next one. Positive samples are
+# printed without sign, so the sign of the second sample is optional
+
+_GLUE_RE = re.compile(r"(e[+-]\d{2})(?=[+-]?\d)")
+
+# Probe ratios supported by the DHO800/900 series
+
+_PROBE_RATIOS = frozenset((
+    0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+    1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000
+))
+
+# Vertical scales (V/div at 1x probe ratio) setable on the device in ascending order
+
+_SETABLE_SCALES = ( 500e-6, 1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 1e-1, 2e-1, 5e-1, 1, 2, 5, 10 )
+
+def _parse_scpi_ascii_floats_py(buf, out):
+    """ Scans comma separated ASCII samples (uint8 array) into out in a single
+        pass. Samples glued together by the scope (the next sample directly
+        following the two digit exponent of the previous one, with or without
+        a sign) are split inline. Returns the number of samples or -1 on
+        malformed input or when out is too small """
+    n = 0
+    i = 0
+    length = len(buf)
+    while i < length:
+        c = buf[i]
+        # Separators: comma, whitespace and line endings
+        if (c == 44) or (c == 32) or (c == 10) or (c == 13):
+            i += 1
+            continue
+
+        sign = 1.0
+        if c == 45:
+            sign = -1.0
+            i += 1
+        elif c == 43:
+            i += 1
+
+        mantissa = 0.0
+        digits = 0
+        fracDigits = 0
+        while (i < length) and (buf[i] >= 48) and (buf[i] <= 57):
+            mantissa = mantissa * 10.0 + (int(buf[i]) - 48)
+            digits += 1
+            i += 1
+        if (i < length) and (buf[i] == 46):
+            i += 1
+            while (i < length) and (buf[i] >= 48) and (buf[i] <= 57):
+                mantissa = mantissa * 10.0 + (int(buf[i]) - 48)
+                digits += 1
+                fracDigits += 1
+                i += 1
+        if digits == 0:
+            return -1
+
+        exponent = 0
+        if (i < length) and ((buf[i] == 101) or (buf[i] == 69)):
+            i += 1
+            expSign = 1
+            if (i < length) and (buf[i] == 45):
+                expSign = -1
+                i += 1
+            elif (i < length) and (buf[i] == 43):
+                i += 1
+            # The scope always sends two exponent digits, anything after them
+            # already belongs to the next sample
+            expDigits = 0
+            while (expDigits < 2) and (i < length) and (buf[i] >= 48) and (buf[i] <= 57):
+                exponent = exponent * 10 + (int(buf[i]) - 48)
+                expDigits += 1
+                i += 1
+            if expDigits == 0:
+                return -1
+            exponent = exponent * expSign
+
+        if n >= len(out):
+            return -1
+
+        # Dividing by an exact power of ten keeps the result correctly rounded
+        # for the 7 significant digits the scope transmits
+        power = exponent - fracDigits
+        if power >= 0:
+            out[n] = sign * mantissa * (10.0 ** power)
+        else:
+            out[n] = sign * mantissa / (10.0 ** (-power))
+        n += 1
+
+        # A sample has to be followed by a separator or the sign or first digit
+        # of a glued sample
+        if i < length:
+            c = buf[i]
+            if not ((c == 44) or (c == 32) or (c == 10) or (c == 13) or (c == 43) or (c == 45) or ((c >= 48) and (c <= 57))):
+                return -1
+    return n
+
+if numba is not None:
+    _parse_scpi_ascii_floats = numba.njit(cache = True)(_parse_scpi_ascii_floats_py)
+else:
+    _parse_scpi_ascii_floats = None
+
+def _parse_bool(resp, ctx):
+    if resp is not None:
+        resp = resp.strip()
+        if resp in ( "1", "ON" ):
+            return True
+        if resp in ( "0", "OFF" ):
+            return False
+    raise CommunicationError_ProtocolViolation(f"Invalid response for {ctx}: {resp!r}")
+
+def _parse_float(resp, ctx):
+    try:
+        return float(resp)
+    except (TypeError, ValueError):
+        raise CommunicationError_ProtocolViolation(f"Invalid response for {ctx}: {resp!r}")
+
+class XAxis:
+    """ Time axis of a waveform described by origin, sample interval and sample
+        count. It behaves like a read only sequence and is only materialized as
+        an array when requested (to_array, np.asarray) """
+
+    __slots__ = ( "origin", "step", "count" )
+
+    def __init__(self, origin, step, count):
+        self.origin = origin
+        self.step = step
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, stride = idx.indices(self.count)
+            return XAxis(self.origin + start * self.step, self.step * stride, len(range(start, stop, stride)))
+
+        if isinstance(idx, (int, np.integer)):
+            if idx < 0:
+                idx = idx + self.count
+            if (idx < 0) or (idx >= self.count):
+                raise IndexError(f"Index {idx} is out of range for {self.count} samples")
+            return self.origin + idx * self.step
+
+        # Fancy indexing with integer or boolean arrays
+        idx = np.asarray(idx)
+        if idx.dtype == bool:
+            if idx.shape != (self.count,):
+                raise IndexError(f"Boolean index of shape {idx.shape} does not match {self.count} samples")
+            idx = np.flatnonzero(idx)
+        elif not np.issubdtype(idx.dtype, np.integer):
+            raise IndexError(f"Only integers, slices and integer or boolean arrays are valid indices, got {idx.dtype}")
+        idx = np.where(idx < 0, idx + self.count, idx)
+        if np.any((idx < 0) | (idx >= self.count)):
+            raise IndexError(f"Index out of range for {self.count} samples")
+        return self.origin + idx * self.step
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self.origin + i * self.step
+
+    def __array__(self, dtype = None, copy = None):
+        arr = self.to_array()
+        if dtype is not None:
+            arr = arr.astype(dtype, copy = False)
+        return arr
+
+    def __repr__(self):
+        return f"XAxis(origin={self.origin}, step={self.step}, count={self.count})"
+
+    def to_array(self):
+        return self.origin + np.arange(self.count, dtype = np.float64) * self.step
+
+    def tolist(self):
+        return self.to_array().tolist()
+
+# Initial size of the pooled waveform receive buffer in bytes
+
+_RECV_BUF_INITIAL = 64 * 1024
+
+class BufferRelaxMode(Enum):
+    """ What happens to the pooled receive buffer after a waveform capture """
+    KEEP = 0        # Never shrink, successive large captures reuse the buffer
+    SHRINK = 1      # Shrink back to the initial chunk size
+    FREE = 2        # Release the buffer completely
+
+class SCPIDeviceEthernetDHO(SCPIDeviceEthernet):
+    """ Extends the generic SCPI transport with reading of IEEE 488.2
+        definite length binary blocks as used for waveform transfers """
+
+    def __init__(self, address = None, port = 5025, logger = None, socketBufferSize = None):
+        super().__init__(address, port, logger)
+        self._socketBufferSize = socketBufferSize
+        self._recv_buf = bytearray(_RECV_BUF_INITIAL)
+
+    def connect(self, address = None, port = None):
+        if self._socket is None:
+            if address is not None:
+                if not isinstance(address, str):
+                    raise ValueError(f"Invalid address {address}")
+                self._address = address
+            if port is not None:
+                if not isinstance(port, int):
+                    raise ValueError("Port has to be an integer number")
+                if (port <= 0) or (port > 65535):
+                    raise ValueError("Port number is out of range 1-65535")
+                self._port = port
+
+            # Commands are small and latency bound while waveform data arrives
+            # in large bursts, so disable Nagle and optionally enlarge the kernel
+            # buffers. The buffer sizes have to be set before connecting since
+            # the TCP window scale is negotiated during the handshake. Linux caps
+            # them at net.core.rmem_max / wmem_max
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            try:
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                if self._socketBufferSize is not None:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self._socketBufferSize)
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self._socketBufferSize)
+                sock.connect((self._address, self._port))
+            except Exception:
+                sock.close()
+                raise
+            self._socket = sock
+        return True
+
+    def scpiCompound(self, commands):
+        """ Sends multiple commands as one semicolon separated message. In case
+            any of them is a query the single response line is split into a
+            list of the individual answers """
+        message = ";".join(commands)
+        if any(cmd.endswith("?") for cmd in commands):
+            resp = self.scpiQuery(message)
+            if resp is None:
+                return None
+            return resp.split(";")
+
+        self.scpiCommand(message)
+        return None
+
+    def _recv_into(self, view):
+        offset = 0
+        while offset < len(view):
+            nbytes = self._socket.recv_into(view[offset:])
+            if nbytes == 0:
+                raise CommunicationError_ProtocolViolation("Connection closed while reading binary block")
+            offset = offset + nbytes
+
+    def reserveBuffer(self, nbytes):
+        """ Returns a memoryview on the first nbytes of the pooled receive buffer,
+            growing it geometrically when required. The view stays valid until
+            the next call to reserveBuffer, readBlock or relaxBuffer """
+        if len(self._recv_buf) < nbytes:
+            # A new bytearray is allocated instead of resizing in place so views
+            # still held on the previous buffer don't block the growth
+            size = max(len(self._recv_buf), _RECV_BUF_INITIAL)
+            while size < nbytes:
+                size = size * 2
+            self._recv_buf = bytearray(size)
+        return memoryview(self._recv_buf)[:nbytes]
+
+    def readBlock(self, nbytes):
+        """ Receives exactly nbytes into the pooled receive buffer """
+        view = self.reserveBuffer(nbytes)
+        self._recv_into(view)
+        return view
+
+    def relaxBuffer(self, mode = BufferRelaxMode.KEEP):
+        if mode == BufferRelaxMode.SHRINK:
+            if len(self._recv_buf) > _RECV_BUF_INITIAL:
+                self._recv_buf = bytearray(_RECV_BUF_INITIAL)
+        elif mode == BufferRelaxMode.FREE:
+            self._recv_buf = bytearray()
+        elif mode != BufferRelaxMode.KEEP:
+            raise ValueError(f"Unknown buffer relax mode {mode}")
+
+    def readDefiniteBlock(self, out = None):
+        """ Reads an IEEE 488.2 definite length block (#NLLLL...) directly into
+            the supplied writable buffer, or the pooled receive buffer when none
+            is given. Returns a memoryview on the received payload """
+
+        # Header is #N followed by N digits specifying the payload length
+        header = bytearray(2)
+        self._recv_into(memoryview(header))
+        if header[0:1] != b"#":
+            raise CommunicationError_ProtocolViolation(f"Expected definite length block, received {header}")
+        try:
+            lengthDigits = bytearray(int(header[1:2]))
+            self._recv_into(memoryview(lengthDigits))
+            length = int(lengthDigits)
+        except ValueError:
+            raise CommunicationError_ProtocolViolation("Invalid definite length block header")
+
+        if out is None:
+            view = self.readBlock(length)
+        else:
+            view = memoryview(out).cast("B")
+            if len(view) < length:
+                raise CommunicationError_ProtocolViolation(f"Definite length block of {length} bytes exceeds receive buffer of {len(view)} bytes")
+            view = view[:length]
+            self._recv_into(view)
+
+        # Consume the terminating newline
+        self._recv_into(memoryview(bytearray(1)))
+        return view
+
+    def scpiQueryBlock(self, query, out = None):
+        if not self.isConnected():
+            raise CommunicationError_NotConnected("Device not connected")
+        self._socket.sendall((query + "\n").encode())
+        return self.readDefiniteBlock(out)
 
 class OscilloscopeMeasurementType(Enum):
     VPP = 0
@@ -39,6 +388,77 @@ class OscilloscopeBandwidthMode(Enum):
     def has_value(cls, v):
         return v in cls._value2member_map_
 
+# Phase measurements are repeated until consecutive readings agree within 10%.
+# Out of range readings are reported as 9.9e+37 by the scope
+
+_MEAS_MAX_TRIES = 16
+_MEAS_MIN_DELAY = 5e-3
+_MEAS_INVALID = 9.9e+37
+
+# Translation between mode enumerations and their SCPI mnemonics
+
+_SWEEP_TO_SCPI = MappingProxyType({
+    OscilloscopeSweepMode.AUTO   : "AUTO",
+    OscilloscopeSweepMode.NORMAL : "NORM",
+    OscilloscopeSweepMode.SINGLE : "SING"
+})
+_SCPI_TO_SWEEP = MappingProxyType({ v : k for k, v in _SWEEP_TO_SCPI.items() })
+
+_TRIGGER_TO_SCPI = MappingProxyType({
+    OscilloscopeTriggerMode.EDGE  : "EDGE",
+    OscilloscopeTriggerMode.PULSE : "PULS",
+    OscilloscopeTriggerMode.SLOPE : "SLOP"
+})
+_SCPI_TO_TRIGGER = MappingProxyType({ v : k for k, v in _TRIGGER_TO_SCPI.items() })
+
+_TIMEBASE_TO_SCPI = MappingProxyType({
+    OscilloscopeTimebaseMode.MAIN : "MAIN",
+    OscilloscopeTimebaseMode.XY   : "XY",
+    OscilloscopeTimebaseMode.ROLL : "ROLL"
+})
+_SCPI_TO_TIMEBASE = MappingProxyType({ v : k for k, v in _TIMEBASE_TO_SCPI.items() })
+
+_COUPLING_TO_SCPI = MappingProxyType({
+    OscilloscopeCouplingMode.DC  : "DC",
+    OscilloscopeCouplingMode.AC  : "AC",
+    OscilloscopeCouplingMode.GND : "GND"
+})
+_SCPI_TO_COUPLING = MappingProxyType({ v : k for k, v in _COUPLING_TO_SCPI.items() })
+
+_RUN_TO_SCPI = MappingProxyType({
+    OscilloscopeRunMode.STOP   : ":STOP",
+    OscilloscopeRunMode.SINGLE : ":SING",
+    OscilloscopeRunMode.RUN    : ":RUN"
+})
+
+# Trigger status as reported by :TRIG:STAT?, everything but STOP means the
+# acquisition is running (TD = triggered, WAIT = waiting for trigger)
+_SCPI_TO_RUN = MappingProxyType({
+    "STOP" : OscilloscopeRunMode.STOP,
+    "RUN"  : OscilloscopeRunMode.RUN,
+    "AUTO" : OscilloscopeRunMode.RUN,
+    "WAIT" : OscilloscopeRunMode.RUN,
+    "TD"   : OscilloscopeRunMode.RUN
+})
+
+_SCPI_TO_BANDWIDTH = MappingProxyType({
+    "OFF" : OscilloscopeBandwidthMode.OFF,
+    "20M" : OscilloscopeBandwidthMode.BW20
+})
+
+_SCPI_TO_MEASUREMENT = MappingProxyType({
+    "VPP"  : OscilloscopeMeasurementType.VPP,
+    "RRPH" : OscilloscopeMeasurementType.RRPH,
+    "FFPH" : OscilloscopeMeasurementType.FFPH,
+    "VMIN" : OscilloscopeMeasurementType.VMIN,
+    "VMAX" : OscilloscopeMeasurementType.VMAX,
+    "VRMS" : OscilloscopeMeasurementType.VRMS,
+    "VAVG" : OscilloscopeMeasurementType.VAVG,
+    "OVER" : OscilloscopeMeasurementType.OVER,
+    "FREQ" : OscilloscopeMeasurementType.FREQ,
+    "PER"  : OscilloscopeMeasurementType.PER
+})
+
 class PYDHO800(Oscilloscope):
     def __init__(
         self,
@@ -47,11 +467,24 @@ class PYDHO800(Oscilloscope):
         port=5555,
 
         useNumpy = False,
-        
+        lazyXAxis = False,         # Return the time axis as XAxis instead of materializing it
+        waveformFormat = "WORD",   # WORD (12 bit) or BYTE (8 bit) binary block transfer, ASCII for the legacy text transfer
+
         rawMode = False,     # Sets the number of samples to retrieve up to the current memory depth of the scope
         samplePoints = 1000, 
+
+        # Socket send and receive buffer size in bytes (e.g. 8*1024*1024 for raw mode captures).
+        # None keeps the system default: on Linux an explicit SO_RCVBUF disables receive
+        # buffer autotuning and is clamped to net.core.rmem_max anyway
+        socketBufferSize = None,
+        bufferRelax = BufferRelaxMode.KEEP  # Handling of the pooled waveform receive buffer after each capture
     ):
-        self._scpi = SCPIDeviceEthernet(address, port, None)
+        if waveformFormat not in _WAV_FORMAT_CODES:
+            raise ValueError(f"Unsupported waveform format {waveformFormat}")
+
+        self._scpi = SCPIDeviceEthernetDHO(address, port, None, socketBufferSize = socketBufferSize)
+        self._waveformFormat = waveformFormat
+        self._bufferRelax = BufferRelaxMode(bufferRelax)
         self._rawMode = rawMode
         self._samplePoints = samplePoints
 
@@ -88,9 +521,22 @@ class PYDHO800(Oscilloscope):
             triggerForceSupported = True
         )
 
+        # Channel command prefixes (:CHANn) and source names (CHANn) are built
+        # once instead of being formatted on every command
+        self._chan_source = tuple(f"CHAN{i+1}" for i in range(self._nchannels))
+        self._chan_prefix = tuple(f":{src}" for src in self._chan_source)
+
         self._probe_ratios = [ 1, 1, 1, 1 ]
 
         self._use_numpy = useNumpy
+        self._lazy_xaxis = lazyXAxis
+
+        # Commands collected by batch(), None while not batching
+        self._batch = None
+
+        # Measurement latency estimate and last settled phase readings
+        self._meas_rtt_ewma = None
+        self._meas_stable = { }
 
         atexit.register(self.__close)
 
@@ -111,6 +557,8 @@ class PYDHO800(Oscilloscope):
                 'serial'       : idnParts[2],
                 'version'      : idnParts[3]
             }
+
+            self.refresh_probe_ratios()
         return True
 
     def _disconnect(self):
@@ -139,10 +587,60 @@ class PYDHO800(Oscilloscope):
             self._off()
             self._disconnect()
 
+    # Command batching
+
+    def _send(self, command):
+        if self._batch is not None:
+            self._batch.append(command)
+        else:
+            self._scpi.scpiCommand(command)
+
+    def _check_not_batching(self):
+        if self._batch is not None:
+            raise ValueError("Queries cannot be issued inside a batch")
+
+    def _query(self, query):
+        self._check_not_batching()
+        return self._scpi.scpiQuery(query)
+
+    def _query_compound(self, queries):
+        self._check_not_batching()
+        return self._scpi.scpiCompound(queries)
+
+    @contextmanager
+    def batch(self):
+        """ Collects all commands issued inside the with block and sends them as a
+            single compound message when the block is left. Queries (including
+            setters that have to query the device like set_timebase_scale) raise
+            a ValueError inside a batch since their answers could not be matched.
+            On an exception the collected commands are discarded and cached
+            probe ratios are restored """
+        if self._batch is not None:
+            # Nested batches are merged into the outer one
+            yield self
+            return
+
+        # Setters update the probe ratio cache while their command is only
+        # buffered, so it has to be rolled back when the batch is not sent
+        probeRatios = list(self._probe_ratios)
+        self._batch = []
+        try:
+            try:
+                yield self
+                commands = self._batch
+            finally:
+                self._batch = None
+
+            if len(commands) > 0:
+                self._scpi.scpiCompound(commands)
+        except BaseException:
+            self._probe_ratios = probeRatios
+            raise
+
     # Commands
 
     def _idn(self):
-        return self._scpi.scpiQuery("*IDN?")
+        return self._query("*IDN?")
 
     def _identify(self):
         resp = self._idn()
@@ -165,115 +663,67 @@ class PYDHO800(Oscilloscope):
         if (channel < 0) or (channel > 3):
             raise ValueError("Invalid channel number for DHO800/900")
         if enabled:
-            self._scpi.scpiCommand(f":CHAN{channel+1}:DISP ON")
+            self._send(f"{self._chan_prefix[channel]}:DISP ON")
         else:
-            self._scpi.scpiCommand(f":CHAN{channel+1}:DISP OFF")
+            self._send(f"{self._chan_prefix[channel]}:DISP OFF")
 
     def _is_channel_enabled(self, channel):
         if (channel < 0) or (channel > 3):
             raise ValueError("Invalid channel number for DHO800/900")
 
-        resp = self._scpi.scpiQuery(f":CHAN{channel+1}:DISP?")
-        try:
-            resp = int(resp)
-            if resp == 1:
-                return True
-            elif resp == 0:
-                return False
-        except:
-            pass
-
-        raise CommunicationError_ProtocolViolation("Failed to query enabled status of channel")
+        resp = self._query(f"{self._chan_prefix[channel]}:DISP?")
+        return _parse_bool(resp, "enabled status of channel")
 
     def _set_sweep_mode(self, mode):
-        if mode == OscilloscopeSweepMode.AUTO:
-            self._scpi.scpiCommand(":TRIG:SWE AUTO")
-        elif mode == OscilloscopeSweepMode.NORMAL:
-            self._scpi.scpiCommand(":TRIG:SWE NORM")
-        elif mode == OscilloscopeSweepMode.SINGLE:
-            self._scpi.scpiCommand(":TRIG:SWE SING")
-        else:
+        if mode not in _SWEEP_TO_SCPI:
             raise ValueError(f"Unknown sweep mode {mode} passed")
+        self._send(f":TRIG:SWE {_SWEEP_TO_SCPI[mode]}")
 
     def _get_sweep_mode(self):
-        resp = self._scpi.scpiCommand(f":TRIG:SWE?")
-
-        modes = {
-            "NORM" : OscilloscopeSweepMode.NORMAL,
-            "SING" : OscilloscopeSweepMode.SINGLE,
-            "AUTO" : OscilloscopeSweepMode.AUTO
-        }
-        if resp in modes:
-            return modes[resp]
-        else:
+        resp = self._query(":TRIG:SWE?")
+        try:
+            return _SCPI_TO_SWEEP[resp]
+        except KeyError:
             raise CommunicationError_ProtocolViolation(f"Unknown sweep mode {resp} received from device")
 
-
     def _set_trigger_mode(self, mode):
-        if mode == OscilloscopeTriggerMode.EDGE:
-            self._scpi.scpiCommand(":TRIG:MODE EDGE")
-        elif mode == OscilloscopeTriggerMode.PULSE:
-            self._scpi.scpiCommand(":TRIG:MODE PULS")
-        elif mode == OscilloscopeTriggerMode.SLOPE:
-            self._scpi.scpiCommand(":TRIG:MODE SLOP")
+        if mode not in _TRIGGER_TO_SCPI:
+            raise ValueError(f"Unknown trigger mode {mode} passed")
+        self._send(f":TRIG:MODE {_TRIGGER_TO_SCPI[mode]}")
 
     def _get_trigger_mode(self):
-        resp = self._scpi.scpiQuery(f":TRIG:MODE?")
-
-        modes = {
-            "EDGE" : OscilloscopeTriggerMode.EDGE,
-            "PULS" : OscilloscopeTriggerMode.PULSE,
-            "SLOP" : OscilloscopeTriggerMode.SLOPE
-        }
-        if resp in modes:
-            return modes[resp]
-        else:
+        resp = self._query(":TRIG:MODE?")
+        try:
+            return _SCPI_TO_TRIGGER[resp]
+        except KeyError:
             raise CommunicationError_ProtocolViolation(f"Unknown trigger mode {resp} received from device")
 
     def _force_trigger(self):
-        self._scpi.scpiCommand(":TFOR")
+        self._send(":TFOR")
 
     def _set_run_mode(self, mode):
-        if mode == OscilloscopeRunMode.STOP:
-            self._scpi.scpiCommand(":STOP")
-        elif mode == OscilloscopeRunMode.SINGLE:
-            self._scpi.scpiCommand(":SING")
-        elif mode == OscilloscopeRunMode.RUN:
-            self._scpi.scpiCommand(":RUN")
+        if mode not in _RUN_TO_SCPI:
+            raise ValueError(f"Unknown run mode {mode} passed")
+        self._send(_RUN_TO_SCPI[mode])
 
     def _get_run_mode(self):
-        resp = self._scpi.scpiQuery(":TRIG:STAT?")
-
-        if resp == "STOP":
-            return OscilloscopeRunMode.STOP
-        elif (resp == "RUN") or (resp == "AUTO"):
-            return OscilloscopeRunMode.RUN
-        elif resp == "WAIT":
-            return OscilloscopeRunMode.RUN
-            
-    def _set_timebase_mode(self, mode):
-        modestr = {
-            OscilloscopeTimebaseMode.MAIN : "MAIN",
-            OscilloscopeTimebaseMode.XY   : "XY",
-            OscilloscopeTimebaseMode.ROLL : "ROLL"
-        }
+        resp = self._query(":TRIG:STAT?")
+        try:
+            return _SCPI_TO_RUN[resp]
+        except KeyError:
+            raise CommunicationError_ProtocolViolation(f"Unknown trigger status {resp} received from device")
 
-        if mode not in modestr:
+    def _set_timebase_mode(self, mode):
+        if mode not in _TIMEBASE_TO_SCPI:
             raise ValueError(f"Unsupported timebase mode {mode}")
 
-        self._scpi.scpiCommand(f":TIM:MODE {modestr[mode]}")
+        self._send(f":TIM:MODE {_TIMEBASE_TO_SCPI[mode]}")
 
     def _get_timebase_mode(self):
-        resp = self._scpi.scpiQuery(f":TIM:MODE?")
-
-        modes = {
-            "MAIN" : OscilloscopeTimebaseMode.MAIN,
-            "XY"   : OscilloscopeTimebaseMode.XY,
-            "ROLL" : OscilloscopeTimebaseMode.ROLL
-        }
-        if resp in modes:
-            return modes[resp]
-        else:
+        resp = self._query(":TIM:MODE?")
+        try:
+            return _SCPI_TO_TIMEBASE[resp]
+        except KeyError:
             raise CommunicationError_ProtocolViolation(f"Unknown timebase mode {resp} received from device")
 
     def _set_timebase_scale(self, scale):
@@ -302,127 +752,99 @@ class PYDHO800(Oscilloscope):
                 raise ValueError(f"Timebase scale {scale}s/div is out of range {tbLimitsYT[self._id['product']][0]}s/div to {tbLimitsYT[self._id['product']][1]}s/div for {self._id['product']}")
 
         # Set timebase
-        self._scpi.scpiCommand(f":TIM:SCAL {scale}")
+        self._send(f":TIM:SCAL {scale}")
 
     def _get_timebase_scale(self):
-        resp = self._scpi.scpiQuery(":TIM:SCAL?")
-        try:
-            resp = float(resp)
-            return resp
-        except:
-            pass
-
-        raise CommunicationError_ProtocolViolation(f"Unknown response for timebase scale: {resp}")
+        resp = self._query(":TIM:SCAL?")
+        return _parse_float(resp, "timebase scale")
 
     def _set_channel_coupling(self, channel, couplingMode):
         if (channel < 0) or (channel > 3):
             raise ValueError(f"Supplied channel number {channel} is out of bounds")
 
-        modestr = {
-            OscilloscopeCouplingMode.DC  : "DC",
-            OscilloscopeCouplingMode.AC  : "AC",
-            OscilloscopeCouplingMode.GND : "GND"
-        }
-
-        if couplingMode not in modestr:
+        if couplingMode not in _COUPLING_TO_SCPI:
             raise ValueError(f"Unsupported coupling mode {couplingMode}")
 
-        self._scpi.scpiCommand(f":CHAN{channel+1}:COUP {modestr[couplingMode]}")
+        self._send(f"{self._chan_prefix[channel]}:COUP {_COUPLING_TO_SCPI[couplingMode]}")
 
     def _get_channel_coupling(self, channel):
         if (channel < 0) or (channel > 3):
             raise ValueError(f"Supplied channel number {channel} is out of bounds")
 
-        resp = self._scpi.scpiQuery(f":CHAN{channel+1}:COUP?")
-
-        modes = {
-            "DC"   : OscilloscopeCouplingMode.DC,
-            "AC"   : OscilloscopeCouplingMode.AC,
-            "GND"  : OscilloscopeCouplingMode.GND
-        }
-        if resp in modes:
-            return modes[resp]
-        else:
+        resp = self._query(f"{self._chan_prefix[channel]}:COUP?")
+        try:
+            return _SCPI_TO_COUPLING[resp]
+        except KeyError:
             raise CommunicationError_ProtocolViolation(f"Unknown coupling mode {resp} received from device")
 
     def _set_channel_probe_ratio(self, channel, ratio):
         if (channel < 0) or (channel >= self._nchannels):
             raise ValueError(f"Channel index {channel} is out of bounds")
-        if ratio not in [ 0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000 ]:
+        if ratio not in _PROBE_RATIOS:
             raise ValueError(f"Ratio {ratio} is not supported by this device")
 
         self._probe_ratios[channel] = ratio
-        self._scpi.scpiCommand(f":CHAN{channel+1}:PROB {ratio}")
+        self._send(f"{self._chan_prefix[channel]}:PROB {ratio}")
 
     def _get_channel_probe_ratio(self, channel):
         if (channel < 0) or (channel > 3):
             raise ValueError(f"Supplied channel number {channel} is out of bounds")
-        resp = self._scpi.scpiQuery(f":CHAN{channel+1}:PROB?")
-
-        try:
-            resp = float(resp)
-        except:
-            return None
-
-        if resp not in [ 0.0001, 0.0002, 0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000 ]:
+        resp = _parse_float(self._query(f"{self._chan_prefix[channel]}:PROB?"), "probe ratio")
+        if resp not in _PROBE_RATIOS:
             raise CommunicationError_ProtocolViolation(f"Received unsupported probe ratio {resp}")
+
+        self._probe_ratios[channel] = resp
         return resp
 
+    def refresh_probe_ratios(self):
+        """ Reloads the cached probe ratios of all channels from the device. This
+            is only required when the ratio has been changed on the scope itself """
+        for channel in range(self._nchannels):
+            self._get_channel_probe_ratio(channel)
+
     def _set_channel_scale(self, channel, scale):
         if (channel < 0) or (channel > 3):
             raise ValueError(f"Supplied channel number {channel} is out of bounds")
         scale = float(scale)
 
         # Check it's a scale that's actually setable - one has to also look at channel probe ratio though ...
-        setableScales = [ 500e-6, 1e-3, 2e-3, 5e-3, 1e-2, 2e-2, 5e-2, 1e-1, 2e-1, 5e-1, 1, 2, 5, 10 ]
-
-        currentProbeRatio = self._get_channel_probe_ratio(channel)
-        if currentProbeRatio is None:
-            raise CommunicationError_ProtocolViolation("Failed to query current probe ratio")
+        currentProbeRatio = self._probe_ratios[channel]
         scale = scale / currentProbeRatio
         
-        match_scale = 0
-        for _scale in setableScales:
-            if (float(_scale) < float(scale)):
-                match_scale = _scale
-                
-        if match_scale not in setableScales:
-            raise ValueError("Scale out of range [{500e-6 * currentProbeRatio};{10 * currentProbeRatio}] ({currentProbeRatio}x probe selected) in 1,2,5 steps")
+        # Largest setable scale not exceeding the requested one. The division by
+        # the probe ratio is inexact, so allow a small relative tolerance to keep
+        # exactly setable scales from dropping a step
+        idx = bisect_right(_SETABLE_SCALES, scale * (1 + 1e-9)) - 1
+        if idx < 0:
+            raise ValueError(f"Scale out of range [{_SETABLE_SCALES[0] * currentProbeRatio};{_SETABLE_SCALES[-1] * currentProbeRatio}] ({currentProbeRatio}x probe selected) in 1,2,5 steps")
+        match_scale = _SETABLE_SCALES[idx]
 
-        self._scpi.scpiCommand(f":CHAN{channel+1}:SCAL {match_scale}")
+        self._send(f"{self._chan_prefix[channel]}:SCAL {match_scale}")
 
     def _get_channel_scale(self, channel):
         if (channel < 0) or (channel > 3):
             raise ValueError(f"Supplied channel number {channel} is out of bounds")
-        resp = self._scpi.scpiQuery(f":CHAN{channel+1}:SCAL?")
-        try:
-            resp = float(resp)
-        except:
-            return None
 
-        scalefactor = self._get_channel_probe_ratio(self, channel)
-        if scalefactor is None:
-            raise CommunicationError_ProtocolViolation("Failed to query current probe ratio")
+        # Scale and probe ratio are fetched together so a ratio changed on the
+        # scope itself is picked up without an additional round trip
+        resp = self._query_compound([ f"{self._chan_prefix[channel]}:SCAL?", f"{self._chan_prefix[channel]}:PROB?" ])
+        if (resp is None) or (len(resp) != 2):
+            raise CommunicationError_ProtocolViolation(f"Invalid response for channel scale and probe ratio: {resp!r}")
 
-        return resp * scalefactor
+        scale = _parse_float(resp[0], "channel scale")
+        ratio = _parse_float(resp[1], "probe ratio")
+        if ratio not in _PROBE_RATIOS:
+            raise CommunicationError_ProtocolViolation(f"Received unsupported probe ratio {ratio}")
+
+        self._probe_ratios[channel] = ratio
+        return scale * ratio
 
     def _waveform_get_xscale(self):
-        xinc = self._scpi.scpiQuery(":WAV:XINC?")
-        if xinc is None:
-            raise CommunicationError_ProtocolViolation("Did not receive valid response to XINC")
-        xorigin = self._scpi.scpiQuery(":WAV:XOR?")
-        if xorigin is None:
-            raise CommunicationError_ProtocolViolation("Did not receive valid response to XORIGIN")
-        xref = self._scpi.scpiQuery(":WAV:XREF?")
-        if xref is None:
-            raise CommunicationError_ProtocolViolation("Did not receive valid response to XREF")
+        resp = self._query_compound([ ":WAV:XINC?", ":WAV:XOR?", ":WAV:XREF?" ])
+        if (resp is None) or (len(resp) != 3):
+            raise CommunicationError_ProtocolViolation("Did not receive valid response to XINC, XORIGIN and XREF")
 
-        try:
-            xinc = float(xinc)
-            xorigin = float(xorigin)
-            xref = float(xref)
-        except:
-            raise CommunicationError_ProtocolViolation("Did not receive valid reply on XINC, XORIGIN or XREF")
+        xinc, xorigin, xref = ( _parse_float(r, "XINC, XORIGIN or XREF") for r in resp )
 
         # This is:
         #	Interval between two neighboring points
@@ -431,22 +853,11 @@ class PYDHO800(Oscilloscope):
         return xinc, xorigin, xref
 
     def _waveform_get_yscale(self):
-        xinc = self._scpi.scpiQuery(":WAV:YINC?")
-        if xinc is None:
-            raise CommunicationError_ProtocolViolation("Did not receive valid response to YINC")
-        xorigin = self._scpi.scpiQuery(":WAV:YOR?")
-        if xorigin is None:
-            raise CommunicationError_ProtocolViolation("Did not receive valid response to YORIGIN")
-        xref = self._scpi.scpiQuery(":WAV:YREF?")
-        if xref is None:
-            raise CommunicationError_ProtocolViolation("Did not receive valid response to YREF")
+        resp = self._query_compound([ ":WAV:YINC?", ":WAV:YOR?", ":WAV:YREF?" ])
+        if (resp is None) or (len(resp) != 3):
+            raise CommunicationError_ProtocolViolation("Did not receive valid response to YINC, YORIGIN and YREF")
 
-        try:
-            xinc = float(xinc)
-            xorigin = float(xorigin)
-            xref = float(xref)
-        except:
-            raise CommunicationError_ProtocolViolation("Did not receive valid reply on YINC, YORIGIN or YREF")
+        xinc, xorigin, xref = ( _parse_float(r, "YINC, YORIGIN or YREF") for r in resp )
 
         # This is:
         #	Interval between two neighboring points
@@ -455,52 +866,53 @@ class PYDHO800(Oscilloscope):
         return xinc, xorigin, xref
     
     def _get_num_points(self):
-        resp = self._scpi.scpiQuery(":WAV:POIN?")
+        resp = self._query(":WAV:POIN?")
         return resp
 
-    def _query_waveform(self, channel, stats = None):
-        """ When raw mode is enabled, the number of points is set by the scope's memory depth setting
-            This will generally take significantly longer as the memory depth is much larger """
-
-        if isinstance(channel, list) or isinstance(channel, tuple):
-            resp = None
+    def _waveform_read_ascii(self, points):
+        respdata = self._query(":WAV:DATA?")
+        if respdata is None:
+            raise CommunicationError_ProtocolViolation("Failed to query trace from DHO800")
 
-            for ch in channel:
-                resp_next = self._query_waveform(ch)
-                if resp is None:
-                    resp = {
-                        'x' : resp_next['x'],
-                        f"y{ch}" : resp_next['y']
-                    }
-                else:
-                    resp[f"y{ch}"] = resp_next['y']
-            return resp
-        
-        if (channel < 0) or (channel >= self._nchannels):
-            raise ValueError(f"Channel {channel} is out of range [0;{self._nchannels-1}]")
-        if self._rawMode:
-            if self._get_run_mode() != OscilloscopeRunMode.STOP:
-                raise CommunicationError_ProtocolViolation("You must run OscilloscopeRunMode.STOP before capturing in raw mode")
-            self._scpi.scpiCommand(f":WAV:MODE RAW")
-            self._scpi.scpiCommand(f":WAV:POIN RAW")
+        # Only relevant for raw mode where more than 999_999 samples are requested.
+        # Periodically the scope glues two samples together without a separator
+        # (the interval differs between models). The numba scanner splits them
+        # inline, otherwise we insert the missing comma after the exponent of
+        # the first sample before parsing
+        if _parse_scpi_ascii_floats is not None:
+            wavedata = np.empty(points, dtype = np.float64)
+            nsamples = _parse_scpi_ascii_floats(np.frombuffer(respdata.encode(), dtype = np.uint8), wavedata)
+            if nsamples < 0:
+                raise CommunicationError_ProtocolViolation(f"Malformed ASCII waveform data or more samples than the {points} announced by the preamble")
         else:
-            self._scpi.scpiCommand(f":WAV:MODE NORM")
-            self._scpi.scpiCommand(f":WAV:POIN {self._samplePoints} NORM")
-        self._scpi.scpiCommand(f":WAV:SOUR CHAN{channel+1}")
-        self._scpi.scpiCommand(f":WAV:FORM ASCII")
-        resppre = self._scpi.scpiQuery(":WAV:PRE?")
-        respdata = self._scpi.scpiQuery(":WAV:DATA?")
-
-        if (resppre is None) or (respdata is None):
+            respdata = _GLUE_RE.sub(r"\1,", respdata).rstrip(",")
+            try:
+                wavedata = np.fromstring(respdata, sep = ",", dtype = np.float64)
+            except ValueError:
+                raise CommunicationError_ProtocolViolation("Malformed ASCII waveform data")
+            nsamples = len(wavedata)
+
+        if nsamples != points:
+            raise CommunicationError_ProtocolViolation(f"Received {nsamples} samples while preamble announced {points}")
+
+        return wavedata
+
+    def _read_one_channel_data(self, channel, fmt):
+        """ Selects the given channel as waveform source and fetches its preamble
+            and sample data. Mode, point count and format have to be set up already """
+
+        resppre = self._scpi.scpiCompound([ f":WAV:SOUR {self._chan_source[channel]}", ":WAV:PRE?" ])
+
+        if resppre is None:
             raise CommunicationError_ProtocolViolation("Failed to query trace from DHO800")
 
         # Parse preamble ...
-        pre = resppre.split(",")
+        pre = resppre[0].split(",")
         if len(pre) != 10:
             raise CommunicationError_ProtocolViolation("Unknown preamble format")
 
-        if int(pre[0]) != 2:
-            raise CommunicationError_ProtocolViolation(f"Requested ASCII but received format {pre[0]}")
+        if int(pre[0]) != _WAV_FORMAT_CODES[fmt]:
+            raise CommunicationError_ProtocolViolation(f"Requested {fmt} but received format {pre[0]}")
         if (int(pre[1]) != 0) and (int(pre[1]) != 2):
             raise CommunicationError_ProtocolViolation(f"Requested Normal(0)/Raw(2) data, but received {pre[1]}")
         points = int(pre[2])
@@ -512,124 +924,182 @@ class PYDHO800(Oscilloscope):
         yorigin = float(pre[8])
         yref = float(pre[9])
 
-        wavedata = respdata.split(",")
-        
-        """ Only relevent for raw mode wheree more than 999_999 samples are requested
-            Every 999_999 samples, there is a gltich where two samples are received on one line
-            Incase Rigol fixes this, we make sure the length of the line is greater than one data point 
-            EDIT: The interval is different on the DHO914S, so we only check for the length of the line being greater than one sample point """
-        i = 0
+        if fmt == "ASCII":
+            wavedata = self._waveform_read_ascii(points)
+        else:
+            # Binary transfer is limited per query so we fetch the trace in
+            # chunks directly into the pooled receive buffer. While the next chunk is received
+            # the previous one is converted in a worker thread (numpy releases
+            # the GIL), at most two conversions are in flight at any time
+            dtype = _WAV_DTYPES[fmt]
+            chunkPoints = _WAV_CHUNK_POINTS[fmt]
+            rawdata = self._scpi.reserveBuffer(points * dtype.itemsize)
+            raw = np.frombuffer(rawdata, dtype = dtype)
+            wavedata = np.empty(points, dtype = np.float32)
+
+            def convert(first, last):
+                out = wavedata[first:last]
+                np.subtract(raw[first:last], yorigin + yref, out = out, dtype = np.float32)
+                np.multiply(out, yinc, out = out)
+
+            pending = deque()
+            with ThreadPoolExecutor(max_workers = 1) as executor:
+                for start in range(0, points, chunkPoints):
+                    stop = min(start + chunkPoints, points)
+                    self._scpi.scpiCompound([ f":WAV:STAR {start+1}", f":WAV:STOP {stop}" ])
+                    block = self._scpi.scpiQueryBlock(":WAV:DATA?", rawdata[start * dtype.itemsize:])
+                    if len(block) != (stop - start) * dtype.itemsize:
+                        raise CommunicationError_ProtocolViolation(f"Received {len(block) // dtype.itemsize} samples for points {start+1} to {stop}")
+
+                    if len(pending) >= 2:
+                        pending.popleft().result()
+                    pending.append(executor.submit(convert, start, stop))
+
+                for conversion in pending:
+                    conversion.result()
+
+        return xinc, xorigin, wavedata
+
+    def _query_waveform(self, channel, stats = None, fmt = None):
+        """ When raw mode is enabled, the number of points is set by the scope's memory depth setting
+            This will generally take significantly longer as the memory depth is much larger
 
-        while(i < len(wavedata)):
-            try:
-                if(len(wavedata[i]) > 14):
-                    two_fold = wavedata[i].split('e', 1)
-                    first_num = two_fold[0] + 'e' + two_fold[1][:3]
-                    second_num = two_fold[1][3:]
-                    
-                    wavedata.pop(i)
-                    wavedata.insert(i, float(first_num))
-                    wavedata.insert(i+1, float(second_num))
-                    i += 2
-                else:
-                    data_float = float(wavedata[i])
-                    wavedata[i] = data_float
-                    i += 1
-            except:
-                if(i != len(wavedata) - 1):
-                    raise CommunicationError_ProtocolViolation(f"An error occured trying to fix the glitch where two values are combined on one line from the scope \
-                        Data received: {wavedata[i]}. \
-                        First parsed number: {first_num}, Second parsed number: {second_num}")
-            
-        # Build x axis ...
-        if self._use_numpy:
-            import numpy as np
-            dpoints = len(wavedata)
-            xdata = np.linspace(xorigin, xorigin + dpoints * xinc, dpoints)
-            ydata = np.asarray(wavedata)
+            fmt overrides the waveform format (WORD, BYTE or ASCII) set in the constructor """
+
+        self._check_not_batching()
+
+        if fmt is None:
+            fmt = self._waveformFormat
+        if fmt not in _WAV_FORMAT_CODES:
+            raise ValueError(f"Unsupported waveform format {fmt}")
+
+        multiChannel = isinstance(channel, list) or isinstance(channel, tuple)
+        channels = channel if multiChannel else [ channel ]
+
+        for ch in channels:
+            if (ch < 0) or (ch >= self._nchannels):
+                raise ValueError(f"Channel {ch} is out of range [0;{self._nchannels-1}]")
+
+        if self._rawMode:
+            if self._get_run_mode() != OscilloscopeRunMode.STOP:
+                raise CommunicationError_ProtocolViolation("You must run OscilloscopeRunMode.STOP before capturing in raw mode")
+            setup = [ ":WAV:MODE RAW", ":WAV:POIN RAW" ]
         else:
-            xdata = []
-            curx = xorigin
-            dpoints = len(wavedata)
-            for i in range(dpoints):
-                xdata.append(curx)
-                curx = curx + xinc
-            ydata = wavedata
+            setup = [ ":WAV:MODE NORM", f":WAV:POIN {self._samplePoints} NORM" ]
+        setup.append(f":WAV:FORM {fmt}")
+
+        # The acquisition setup is shared by all channels and sent as a single
+        # message, only source selection, preamble and data are queried per channel
+        self._scpi.scpiCompound(setup)
 
         # Return trace X and Y axis ...
         #
         # The baseclass might add some statistics later on to the same dictionary
 
-        res = {
-            'x' : xdata,
-            'y' : ydata
-        }
+        res = { 'x' : None }
+        try:
+            for ch in channels:
+                xinc, xorigin, ydata = self._read_one_channel_data(ch, fmt)
+
+                # All channels share the same time base so the x axis is built once.
+                # With lazyXAxis it stays an XAxis, a full array is only allocated on demand
+                if res['x'] is None:
+                    xdata = XAxis(xorigin, xinc, len(ydata))
+                    if self._lazy_xaxis:
+                        res['x'] = xdata
+                    elif self._use_numpy:
+                        res['x'] = xdata.to_array()
+                    else:
+                        res['x'] = xdata.tolist()
+
+                if not self._use_numpy:
+                    ydata = ydata.tolist()
+
+                if multiChannel:
+                    res[f"y{ch}"] = ydata
+                else:
+                    res['y'] = ydata
+        finally:
+            # Also release a grown buffer when a transfer fails midway
+            self._scpi.relaxBuffer(self._bufferRelax)
 
         return res
     
     def get_memory_depth(self):
-        resp = self._scpi.scpiQuery(":ACQ:MDEP?")
+        resp = self._query(":ACQ:MDEP?")
         return resp
     
     def get_channel_bandwidth(self, channel):
         if (channel < 0) or (channel > 3):
             raise ValueError("Invalid channel number for DHO800/900")
-        resp = self._scpi.scpiQuery(f":CHAN{channel+1}:BWL?")
+        resp = self._query(f"{self._chan_prefix[channel]}:BWL?")
         return resp
     
     def set_channel_bandwidth(self, channel, bandwidth = 'OFF'):
-        bw_modes = {
-            "OFF"   : OscilloscopeBandwidthMode.OFF,
-            "20M"   : OscilloscopeBandwidthMode.BW20
-        }
-        
         if (channel < 0) or (channel > 3):
             raise ValueError("Invalid channel number for DHO800/900")
             
-        if bandwidth not in bw_modes:
+        if bandwidth not in _SCPI_TO_BANDWIDTH:
             raise ValueError(f"Unsupported OscilloscopeBandwidthMode {bandwidth}")
             
-        resp = self._scpi.scpiCommand(f":CHAN{channel+1}:BWL {bandwidth}")
+        resp = self._send(f"{self._chan_prefix[channel]}:BWL {bandwidth}")
         return resp
     
+    def _query_measurement(self, query):
+        t0 = perf_counter()
+        resp = self._query(query)
+        rtt = perf_counter() - t0
+
+        if self._meas_rtt_ewma is None:
+            self._meas_rtt_ewma = rtt
+        else:
+            self._meas_rtt_ewma = 0.8 * self._meas_rtt_ewma + 0.2 * rtt
+
+        return _parse_float(resp, "measurement")
+
     def get_channel_measurement(self, type, channel = None, refchannel = None):
-        typestr = {
-            "VPP" : OscilloscopeMeasurementType.VPP ,
-            "RRPH" : OscilloscopeMeasurementType.RRPH ,
-            "FFPH" : OscilloscopeMeasurementType.FFPH ,
-            "VMIN" : OscilloscopeMeasurementType.VMIN ,
-            "VMAX" : OscilloscopeMeasurementType.VMAX ,
-            "VRMS" : OscilloscopeMeasurementType.VRMS ,
-            "VAVG" : OscilloscopeMeasurementType.VAVG ,
-            "OVER" : OscilloscopeMeasurementType.OVER ,
-            "FREQ" : OscilloscopeMeasurementType.FREQ ,
-            "PER" : OscilloscopeMeasurementType.PER 
-        }
         if (channel < 0) or (channel > 3):
             raise ValueError("Invalid channel number for DHO800/900")
             
-        if type not in typestr:
+        if type not in _SCPI_TO_MEASUREMENT:
             raise ValueError(f"Unsupported OscilloscopeMeasurementType {type}")
             
         if (channel is None):
             raise ValueError(f"Missing channel parameter in function call for channel {channel}")
             
-        if ((typestr[type] is OscilloscopeMeasurementType.RRPH) or (typestr[type] is OscilloscopeMeasurementType.FFPH)):
+        if ((_SCPI_TO_MEASUREMENT[type] is OscilloscopeMeasurementType.RRPH) or (_SCPI_TO_MEASUREMENT[type] is OscilloscopeMeasurementType.FFPH)):
             if (refchannel is None):
                 raise ValueError(f"Missing refchannel parameter in function call for type {type}")
             else:
                 if (refchannel < 0) or (refchannel > 3):
                     raise ValueError("Invalid refchannel number for DHO800/900")
                 
-            # out of range scope resonse is 9.9e+37
-            resp1 = 0
-            resp2 = 1
-            while((resp1 >= 9.9e+37) or (abs(resp1) > (abs(resp2) * 1.1)) or  (abs(resp1) < (abs(resp2) * 0.9))):
-                resp1 = float(self._scpi.scpiQuery(f":MEAS:ITEM? {type},CHAN{refchannel+1},CHAN{channel+1}"))
-                resp2 = float(self._scpi.scpiQuery(f":MEAS:ITEM? {type},CHAN{refchannel+1},CHAN{channel+1}"))
-            resp = (resp1 + resp2 ) /2
+            # Phase readings settle slowly, so we poll until two consecutive readings
+            # agree. The last stable value seeds the comparison so a quiescent
+            # signal only costs a single query. A cached seed only confirms that the
+            # reading settled, it never enters the returned value
+            query = f":MEAS:ITEM? {type},{self._chan_source[refchannel]},{self._chan_source[channel]}"
+            key = (type, refchannel, channel)
+            previous = self._meas_stable.get(key)
+            previousCached = previous is not None
+            resp = None
+            for attempt in range(_MEAS_MAX_TRIES):
+                current = self._query_measurement(query)
+                if current >= _MEAS_INVALID:
+                    current = None
+                elif (previous is not None) and (abs(current) <= abs(previous) * 1.1) and (abs(current) >= abs(previous) * 0.9):
+                    resp = current if previousCached else (previous + current) / 2
+                    break
+                previous = current
+                previousCached = False
+                if attempt < _MEAS_MAX_TRIES - 1:
+                    sleep(max(self._meas_rtt_ewma * 0.5, _MEAS_MIN_DELAY))
+
+            if resp is None:
+                raise CommunicationError_Timeout(f"{type} measurement did not settle within {_MEAS_MAX_TRIES} readings")
+            self._meas_stable[key] = resp
         else:
-            resp = self._scpi.scpiQuery(f":MEAS:ITEM? {type},CHAN{channel+1}")
+            resp = self._query(f":MEAS:ITEM? {type},{self._chan_source[channel]}")
                         
         if (resp is None):
             raise CommunicationError_ProtocolViolation("Failed measurement from DHO800")
@@ -651,7 +1121,7 @@ class PYDHO800(Oscilloscope):
         if not isinstance(depth, self.memory_depth_t):
             raise ValueError("Invalid memory depth specified")
 
-        self._scpi.scpiCommand(f":ACQ:MDEP {depth.value}")
+        self._send(f":ACQ:MDEP {depth.value}")
     
 
     # Signal Generator Settings (Only relevant for DHO914S and DHO924S)
@@ -668,41 +1138,41 @@ class PYDHO800(Oscilloscope):
         if not isinstance(waveform, self.signal_gen_waveform_t):
             raise ValueError("Invalid waveform specified")
 
-        self._scpi.scpiCommand(f":SOUR:FUNC {waveform.value}")
+        self._send(f":SOUR:FUNC {waveform.value}")
 
     def get_signal_gen_waveform(self):
-        resp = self._scpi.scpiQuery(":SOUR:FUNC?")
+        resp = self._query(":SOUR:FUNC?")
         return resp
 
     def set_signal_gen_freq(self, freq_Hz):
-        self._scpi.scpiCommand(f":SOUR:FREQ {freq_Hz}")
+        self._send(f":SOUR:FREQ {freq_Hz}")
 
     def get_signal_gen_freq(self):
-        resp = self._scpi.scpiQuery(":SOUR:FREQ?")
+        resp = self._query(":SOUR:FREQ?")
         return resp
     
     def set_signal_gen_phase(self, phase_deg:float):
         """ Input is in degrees """
-        self._scpi.scpiCommand(f":SOUR:PHAS {phase_deg}")
+        self._send(f":SOUR:PHAS {phase_deg}")
 
     def get_signal_gen_phase(self):
-        resp = self._scpi.scpiQuery(":SOUR:PHAS?")
+        resp = self._query(":SOUR:PHAS?")
         return resp
     
     def set_signal_gen_amp(self, amp_Vpp: float):
         """ Input is in volts, max is 10Vpp"""
         print(f"Setting amp to {amp_Vpp}")
-        self._scpi.scpiCommand(f":SOUR:VOLT:AMPL {amp_Vpp}")
+        self._send(f":SOUR:VOLT:AMPL {amp_Vpp}")
 
     def get_signal_gen_amp(self):
-        resp = self._scpi.scpiQuery(":SOUR:VOLT:AMPL?")
+        resp = self._query(":SOUR:VOLT:AMPL?")
         return resp
     
     def set_signal_gen_offset(self, offset_V: float):
         """ Input is in volts"""
-        self._scpi.scpiCommand(f":SOUR:VOLT:OFFS {offset_V}")
+        self._send(f":SOUR:VOLT:OFFS {offset_V}")
 
     def get_signal_gen_offset(self):
-        resp = self._scpi.scpiQuery(":SOUR:VOLT:OFFS?")
+        resp = self._query(":SOUR:VOLT:OFFS?")
         return resp
     
\ No newline at end of file
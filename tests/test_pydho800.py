@@ -0,0 +1,293 @@
+import numpy as np
+import pytest
+
+import pydho800.pydho800 as dho
+
+def _scope_answering(monkeypatch, response):
+    scope = dho.PYDHO800()
+    monkeypatch.setattr(scope, "_query", lambda query : response)
+    return scope
+
+# Samples glued together by the scope with and without sign of the second sample
+
+GLUED_PAYLOADS = [
+    ( "1.234567e-01-2.000000e-02,3.000000e+00", [ 0.1234567, -0.02, 3.0 ] ),
+    ( "1.234567e-012.000000e-02,3.000000e+00", [ 0.1234567, 0.02, 3.0 ] ),
+    ( "-1.000000e+00,1.234567e-01+2.000000e-02", [ -1.0, 0.1234567, 0.02 ] )
+]
+
+ASCII_SCANNERS = [ None, dho._parse_scpi_ascii_floats_py ]
+if dho._parse_scpi_ascii_floats is not None:
+    ASCII_SCANNERS.append(dho._parse_scpi_ascii_floats)
+
+@pytest.mark.parametrize("scanner", ASCII_SCANNERS)
+@pytest.mark.parametrize("payload, expected", GLUED_PAYLOADS)
+def test_read_ascii_splits_glued_samples(monkeypatch, scanner, payload, expected):
+    monkeypatch.setattr(dho, "_parse_scpi_ascii_floats", scanner)
+    scope = _scope_answering(monkeypatch, payload)
+    assert scope._waveform_read_ascii(len(expected)).tolist() == expected
+
+@pytest.mark.parametrize("ratio, requested, expected", [
+    ( 1, 1.0, 1 ),
+    ( 1, 10, 10 ),
+    ( 1, 500e-6, 500e-6 ),
+    ( 1, 0.3, 0.2 ),
+    ( 1, 100, 10 ),
+    ( 10, 1.0, 1e-1 ),
+    ( 0.1, 0.01, 0.1 ),
+    ( 0.0001, 5e-8, 500e-6 ),
+])
+def test_set_channel_scale_selects_largest_scale_not_exceeding(monkeypatch, ratio, requested, expected):
+    scope = dho.PYDHO800()
+    sent = []
+    monkeypatch.setattr(scope, "_send", sent.append)
+    scope._probe_ratios[0] = ratio
+    scope._set_channel_scale(0, requested)
+    assert sent == [ f":CHAN1:SCAL {expected}" ]
+
+def test_set_channel_scale_below_range(monkeypatch):
+    scope = dho.PYDHO800()
+    monkeypatch.setattr(scope, "_send", lambda command : None)
+    with pytest.raises(ValueError):
+        scope._set_channel_scale(0, 400e-6)
+
+def test_read_ascii_rejects_malformed_data(monkeypatch):
+    monkeypatch.setattr(dho, "_parse_scpi_ascii_floats", None)
+    scope = _scope_answering(monkeypatch, "1.000000e+00,garbage,3.000000e+00")
+    with pytest.raises(dho.CommunicationError_ProtocolViolation):
+        scope._waveform_read_ascii(3)
+
+def _scope_measuring(monkeypatch, readings):
+    scope = dho.PYDHO800()
+    readings = iter(readings)
+    sleeps = []
+    monkeypatch.setattr(scope, "_query_measurement", lambda query : next(readings))
+    monkeypatch.setattr(dho, "sleep", sleeps.append)
+    scope._meas_rtt_ewma = 0.0
+    return scope, sleeps
+
+def test_phase_measurement_averages_fresh_readings(monkeypatch):
+    scope, _ = _scope_measuring(monkeypatch, [ 9.9e+37, 40.0, 44.0 ])
+    assert scope.get_channel_measurement("RRPH", channel = 1, refchannel = 0) == 42.0
+
+def test_phase_measurement_cached_seed_is_not_averaged(monkeypatch):
+    scope, _ = _scope_measuring(monkeypatch, [ 40.0, 44.0, 43.0 ])
+    assert scope.get_channel_measurement("RRPH", channel = 1, refchannel = 0) == 42.0
+    assert scope.get_channel_measurement("RRPH", channel = 1, refchannel = 0) == 43.0
+
+def test_phase_measurement_timeout_does_not_sleep_after_last_reading(monkeypatch):
+    readings = [ 10.0 * (2 ** i) for i in range(dho._MEAS_MAX_TRIES) ]
+    scope, sleeps = _scope_measuring(monkeypatch, readings)
+    with pytest.raises(dho.CommunicationError_Timeout):
+        scope.get_channel_measurement("FFPH", channel = 1, refchannel = 0)
+    assert len(sleeps) == dho._MEAS_MAX_TRIES - 1
+
+def test_xaxis_indexing():
+    x = dho.XAxis(-1.0, 0.5, 5)
+    assert x[1] == -0.5
+    assert x[-1] == 1.0
+    assert x[1:4].tolist() == [ -0.5, 0.0, 0.5 ]
+    assert x[np.array([ 0, 4 ])].tolist() == [ -1.0, 1.0 ]
+    assert x[np.array([ True, False, False, False, True ])].tolist() == [ -1.0, 1.0 ]
+    assert np.array_equal(np.asarray(x), np.array([ -1.0, -0.5, 0.0, 0.5, 1.0 ]))
+
+def test_xaxis_rejects_float_index_arrays():
+    with pytest.raises(IndexError):
+        dho.XAxis(0.0, 1.0, 5)[np.array([ 0.5 ])]
+
+class _RecordingSCPI:
+    def __init__(self):
+        self.sent = []
+
+    def isConnected(self):
+        return False
+
+    def scpiCommand(self, command):
+        self.sent.append(command)
+
+    def scpiCompound(self, commands):
+        self.sent.append(";".join(commands))
+
+def test_batch_discarded_restores_probe_ratios():
+    scope = dho.PYDHO800()
+    scope._scpi = _RecordingSCPI()
+    with pytest.raises(RuntimeError):
+        with scope.batch():
+            scope._set_channel_probe_ratio(0, 100)
+            raise RuntimeError("abort")
+
+    assert scope._probe_ratios[0] == 1
+    scope._set_channel_scale(0, 10)
+    assert scope._scpi.sent == [ ":CHAN1:SCAL 10" ]
+
+def test_batch_applies_probe_ratio_to_later_commands():
+    scope = dho.PYDHO800()
+    scope._scpi = _RecordingSCPI()
+    with scope.batch():
+        scope._set_channel_probe_ratio(0, 10)
+        scope._set_channel_scale(0, 10)
+
+    assert scope._probe_ratios[0] == 10
+    assert scope._scpi.sent == [ ":CHAN1:PROB 10;:CHAN1:SCAL 1" ]
+
+class _FragmentingSocket:
+    """ Delivers queued receive data in short fragments. An optional responder
+        maps every line sent to the bytes answered by the device """
+
+    def __init__(self, rx = b"", responder = None, fragment = 7):
+        self.rx = bytearray(rx)
+        self.responder = responder
+        self.fragment = fragment
+        self.sent = []
+
+    def sendall(self, data):
+        for line in data.decode().splitlines():
+            self.sent.append(line)
+            if self.responder is not None:
+                self.rx += self.responder(line)
+
+    def recv(self, nbytes):
+        data = bytes(self.rx[:min(nbytes, self.fragment)])
+        del self.rx[:len(data)]
+        return data
+
+    def recv_into(self, view):
+        data = self.recv(len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+def _block_reader(rx):
+    scpi = dho.SCPIDeviceEthernetDHO()
+    scpi._socket = _FragmentingSocket(rx)
+    return scpi
+
+def test_read_definite_block_into_pooled_buffer():
+    payload = bytes(range(256)) * 3
+    scpi = _block_reader(b"#3768" + payload + b"\n*IDN?\n")
+    assert bytes(scpi.readDefiniteBlock()) == payload
+    # The terminating newline has been consumed, the next answer starts right after it
+    assert bytes(scpi._socket.rx) == b"*IDN?\n"
+
+def test_query_block_into_supplied_buffer():
+    payload = bytes(range(100))
+    scpi = _block_reader(b"#9000000100" + payload + b"\n")
+    out = bytearray(128)
+    block = scpi.scpiQueryBlock(":WAV:DATA?", out)
+    assert scpi._socket.sent == [ ":WAV:DATA?" ]
+    assert bytes(block) == payload
+    assert bytes(out[:100]) == payload
+    assert len(scpi._socket.rx) == 0
+
+@pytest.mark.parametrize("rx", [ b"#0\n", b"123\n", b"#x12\n", b"#21a\n" ])
+def test_read_definite_block_rejects_invalid_header(rx):
+    with pytest.raises(dho.CommunicationError_ProtocolViolation):
+        _block_reader(rx).readDefiniteBlock()
+
+def test_read_definite_block_exceeding_buffer():
+    scpi = _block_reader(b"#216" + bytes(16) + b"\n")
+    with pytest.raises(dho.CommunicationError_ProtocolViolation):
+        scpi.readDefiniteBlock(bytearray(8))
+
+def test_read_definite_block_connection_closed():
+    scpi = _block_reader(b"#216" + bytes(10))
+    with pytest.raises(dho.CommunicationError_ProtocolViolation):
+        scpi.readDefiniteBlock()
+
+class _WaveformResponder:
+    """ Answers the waveform setup, preamble and chunked data queries of a
+        scope holding raw sample data for every channel """
+
+    def __init__(self, fmt, points, yinc = 0.01, yorigin = 3.0, yref = 128.0, shortChunk = None):
+        self.fmt = fmt
+        self.points = points
+        self.yinc = yinc
+        self.yorigin = yorigin
+        self.yref = yref
+        self.shortChunk = shortChunk
+        self.source = 1
+        self.start = 1
+        self.stop = points
+        self.chunks = 0
+        dtype = dho._WAV_DTYPES[fmt]
+        rng = np.random.default_rng(0)
+        self.raw = { ch : rng.integers(0, np.iinfo(dtype).max if fmt == "BYTE" else 4096, points).astype(dtype) for ch in range(1, 5) }
+
+    def expected(self, channel):
+        return (self.raw[channel + 1].astype(np.float64) - self.yorigin - self.yref) * self.yinc
+
+    def __call__(self, line):
+        answers = []
+        for cmd in line.split(";"):
+            if cmd.startswith(":WAV:SOUR CHAN"):
+                self.source = int(cmd[-1])
+            elif cmd.startswith(":WAV:STAR "):
+                self.start = int(cmd.split()[1])
+            elif cmd.startswith(":WAV:STOP "):
+                self.stop = int(cmd.split()[1])
+            elif cmd == ":WAV:PRE?":
+                answers.append(f"{dho._WAV_FORMAT_CODES[self.fmt]},0,{self.points},1,1.0e-06,-5.0e-04,0,{self.yinc},{self.yorigin},{self.yref}")
+            elif cmd == ":WAV:DATA?":
+                payload = self.raw[self.source][self.start - 1:self.stop].tobytes()
+                if self.chunks == self.shortChunk:
+                    payload = payload[:-dho._WAV_DTYPES[self.fmt].itemsize]
+                self.chunks += 1
+                return b"#9" + f"{len(payload):09d}".encode() + payload + b"\n"
+        if answers:
+            return (";".join(answers) + "\n").encode()
+        return b""
+
+def _scope_with_waveform(fmt, points, **kwargs):
+    responder = _WaveformResponder(fmt, points, **kwargs)
+    scope = dho.PYDHO800(useNumpy = True, waveformFormat = fmt)
+    scope._scpi._socket = _FragmentingSocket(responder = responder, fragment = 1 << 20)
+    return scope, responder
+
+@pytest.mark.parametrize("fmt", [ "WORD", "BYTE" ])
+def test_query_waveform_binary_chunks(fmt):
+    points = 300_001
+    scope, responder = _scope_with_waveform(fmt, points)
+    data = scope.query_waveform(2)
+
+    assert data['y'].dtype == np.float32
+    assert np.allclose(data['y'], responder.expected(2), atol = 1e-4)
+    assert len(data['x']) == points
+    chunkPoints = dho._WAV_CHUNK_POINTS[fmt]
+    assert responder.chunks == -(-points // chunkPoints)
+    assert f":WAV:STAR {points - (points - 1) % chunkPoints};:WAV:STOP {points}" in scope._scpi._socket.sent
+
+def test_query_waveform_multiple_channels():
+    scope, responder = _scope_with_waveform("WORD", 150_001)
+    data = scope.query_waveform((0, 3))
+
+    assert np.allclose(data['y0'], responder.expected(0), atol = 1e-4)
+    assert np.allclose(data['y3'], responder.expected(3), atol = 1e-4)
+
+def test_query_waveform_short_chunk():
+    scope, _ = _scope_with_waveform("WORD", 300_001, shortChunk = 1)
+    with pytest.raises(dho.CommunicationError_ProtocolViolation):
+        scope.query_waveform(0)
+
+def test_get_channel_scale_compound_query(monkeypatch):
+    scope = dho.PYDHO800()
+    queries = []
+    answers = iter([ "5.000000e-01;1.000000e+01", "5.000000e-01" ])
+    def scpiQuery(query):
+        queries.append(query)
+        return next(answers)
+    monkeypatch.setattr(scope._scpi, "scpiQuery", scpiQuery)
+
+    # Scale and probe ratio arrive as one semicolon separated answer, the
+    # probe ratio cache is refreshed as a side effect
+    assert scope._get_channel_scale(1) == 5.0
+    assert queries == [ ":CHAN2:SCAL?;:CHAN2:PROB?" ]
+    assert scope._probe_ratios == [ 1, 10, 1, 1 ]
+
+    with pytest.raises(dho.CommunicationError_ProtocolViolation):
+        scope._get_channel_scale(1)
+    assert scope._probe_ratios == [ 1, 10, 1, 1 ]